@@ -104,9 +104,9 @@ def load_to_supabase(staged_csv_path: str, batch_size: int = 100):
     print("🎯 Load complete.")
  
 if __name__ == "__main__":
-    staged_files = sorted([str(p) for p in STAGED_DIR.glob("weather_staged_*.csv")])
-    if not staged_files:
+    latest = max(STAGED_DIR.glob("weather_staged_*.csv"), default=None)  # newest by timestamped name
+    if latest is None:
         raise SystemExit("No staged CSV found. Run transform.py first.")
     create_table_if_not_exists()
-    load_to_supabase(staged_files[-1], batch_size=100)
+    load_to_supabase(str(latest), batch_size=100)
  
\ No newline at end of file
@@ -91,9 +91,9 @@ def transform_data(raw_json_paths: List[str]) -> str:
  
 if __name__ == "__main__":
     # Convenience: transform the latest raw file
-    raw_files = sorted([str(p) for p in RAW_DIR.glob("weather_*.json")])
-    if not raw_files:
+    latest = max(RAW_DIR.glob("weather_*.json"), default=None)  # newest by timestamped name
+    if latest is None:
         raise SystemExit("No raw weather JSON files found. Run extract.py first.")
-    transform_data([raw_files[-1]])
+    transform_data([str(latest)])
  
  
\ No newline at end of file
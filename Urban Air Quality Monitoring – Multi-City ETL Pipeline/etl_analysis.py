@@ -23,12 +23,19 @@ from dotenv import load_dotenv
 from supabase import create_client
 from pathlib import Path
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # file output only; no GUI backend
 import matplotlib.pyplot as plt
 import os
+import time
 from typing import Any
 
 load_dotenv()
 
+# Cheaper line rendering for long hourly series
+matplotlib.rcParams["path.simplify"] = True
+matplotlib.rcParams["path.simplify_threshold"] = 1.0
+
 # Directories
 BASE_DIR = Path(__file__).resolve().parents[0]
 PROCESSED_DIR = BASE_DIR / "data" / "processed"
@@ -39,6 +46,18 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 TABLE_NAME = "air_quality_data"
 
+# Only the columns the analysis reads, fetched page by page
+ANALYSIS_COLUMNS = "city,time,pm2_5,pm10,ozone,severity_score,risk_flag,aqi_category,hour"
+PAGE_SIZE = 1000
+
+# Local Feather snapshot of the full fetch, reused while fresh
+CACHE_PATH = PROCESSED_DIR / "air_quality_main.feather"
+CACHE_TTL = int(os.getenv("CACHE_TTL", 600))
+FORCE_REFRESH = os.getenv("FORCE_REFRESH", "").lower() in ("1", "true", "yes")
+
+# Full-column export of the main table, fetched separately from the pruned analysis columns
+MAIN_TABLE_CSV = PROCESSED_DIR / "air_quality_processed_main.csv"
+
 if not SUPABASE_URL or not SUPABASE_KEY:
     raise SystemExit("Please set SUPABASE_URL and SUPABASE_KEY in your .env")
 
@@ -75,15 +94,46 @@ def _extract_data_from_response(res: Any) -> list:
     return []
 
 
-def fetch_table(limit: int | None = None) -> pd.DataFrame:
-    """Fetch all rows from Supabase table and return cleaned DataFrame."""
+def _cache_is_fresh() -> bool:
+    """True if the Feather snapshot exists and is younger than CACHE_TTL seconds."""
+    return CACHE_PATH.exists() and time.time() - CACHE_PATH.stat().st_mtime < CACHE_TTL
+
+
+def fetch_table(limit: int | None = None, force_refresh: bool = FORCE_REFRESH) -> pd.DataFrame:
+    """Return cleaned table data, from the Feather cache when it is younger than CACHE_TTL seconds."""
+    use_cache = not limit
+    if use_cache and not force_refresh and _cache_is_fresh():
+        print(f"⚡ Using cached table snapshot: {CACHE_PATH}")
+        return pd.read_feather(CACHE_PATH)
+
+    df = _fetch_from_supabase(limit)
+    if use_cache and not df.empty:
+        df.to_feather(CACHE_PATH)
+    return df
+
+
+def _fetch_from_supabase(limit: int | None = None, columns: str = ANALYSIS_COLUMNS) -> pd.DataFrame:
+    """Fetch all rows (the given columns) from Supabase table and return cleaned DataFrame."""
     print(f"🔍 Fetching data from Supabase table '{TABLE_NAME}'...")
-    query = supabase.table(TABLE_NAME).select("*")
-    if limit:
-        query = query.limit(limit)
-    res = query.execute()
+    rows = []
+    start = 0
+    while not limit or start < limit:
+        end = start + PAGE_SIZE - 1
+        if limit:
+            end = min(end, limit - 1)
+        res = (
+            supabase.table(TABLE_NAME)
+            .select(columns)
+            .order("id")
+            .range(start, end)
+            .execute()
+        )
+        page = _extract_data_from_response(res)
+        rows.extend(page)
+        if len(page) < end - start + 1:
+            break
+        start = end + 1
 
-    rows = _extract_data_from_response(res)
     df = pd.DataFrame(rows)
 
     if df.empty:
@@ -106,11 +156,28 @@ def fetch_table(limit: int | None = None) -> pd.DataFrame:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors="coerce")
 
-    # ensure text columns exist and are strings
+    # compact dtypes: text columns as categoricals, hour as nullable int8
     for c in ["city", "risk_flag", "aqi_category"]:
         if c in df.columns:
-            df[c] = df[c].astype(object)
+            df[c] = df[c].astype("category")
+    if "hour" in df.columns:
+        df["hour"] = df["hour"].astype("Int8")
+
+    return df
+
+
+def add_time_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Derive hour-of-day (_hour) and hourly bucket (_date_hour) once for KPIs and plots."""
+    if "time" in df.columns:
+        df["_hour"] = df["time"].dt.hour.astype("Int8")
+        df["_date_hour"] = df["time"].dt.floor("h")  # lowercase 'h' to fix deprecation
+    return df
+
 
+def _ensure_time_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Return df with _hour/_date_hour, deriving them on a shallow copy if the caller skipped add_time_features."""
+    if "time" in df.columns and not {"_hour", "_date_hour"}.issubset(df.columns):
+        return add_time_features(df.copy(deep=False))
     return df
 
 
@@ -121,35 +188,34 @@ def compute_kpis(df: pd.DataFrame) -> dict:
     if df.empty:
         return kpis
 
-    # City with highest average PM2.5
-    if {"city", "pm2_5"}.issubset(df.columns):
-        pm25_by_city = df.groupby("city", as_index=False)["pm2_5"].mean().dropna()
-        if not pm25_by_city.empty:
-            top = pm25_by_city.sort_values("pm2_5", ascending=False).iloc[0]
-            kpis["city_highest_avg_pm2_5"] = {"city": top["city"], "avg_pm2_5": float(top["pm2_5"])}
+    df = _ensure_time_features(df)
 
-    # City with highest average severity_score
-    if {"city", "severity_score"}.issubset(df.columns):
-        sev_by_city = df.groupby("city", as_index=False)["severity_score"].mean().dropna()
-        if not sev_by_city.empty:
-            top = sev_by_city.sort_values("severity_score", ascending=False).iloc[0]
-            kpis["city_highest_severity_score"] = {"city": top["city"], "avg_severity_score": float(top["severity_score"])}
+    # City with highest average PM2.5 / severity_score (single groupby)
+    city_metrics = [c for c in ["pm2_5", "severity_score"] if c in df.columns]
+    if "city" in df.columns and city_metrics:
+        city_agg = df.groupby("city", sort=False, observed=True)[city_metrics].mean()
+
+        if "pm2_5" in city_agg and city_agg["pm2_5"].notna().any():
+            top = city_agg["pm2_5"].idxmax()
+            kpis["city_highest_avg_pm2_5"] = {"city": top, "avg_pm2_5": float(city_agg.at[top, "pm2_5"])}
+
+        if "severity_score" in city_agg and city_agg["severity_score"].notna().any():
+            top = city_agg["severity_score"].idxmax()
+            kpis["city_highest_severity_score"] = {"city": top, "avg_severity_score": float(city_agg.at[top, "severity_score"])}
 
     # Percentage of High/Moderate/Low risk hours
     if "risk_flag" in df.columns:
         total = len(df)
-        risk_counts = df["risk_flag"].fillna("Unknown").value_counts()
-        risk_pct = {str(k): round((v / total) * 100, 2) for k, v in risk_counts.items()}
+        risk_counts = df["risk_flag"].value_counts(dropna=False)
+        risk_pct = {("Unknown" if pd.isna(k) else str(k)): round((v / total) * 100, 2) for k, v in risk_counts.items()}
         kpis["risk_percentage"] = risk_pct
 
     # Hour of day with worst AQI (by avg pm2_5)
-    if {"time", "pm2_5"}.issubset(df.columns):
-        temp = df.dropna(subset=["time", "pm2_5"]).copy()
-        if not temp.empty:
-            temp["hour_of_day"] = temp["time"].dt.hour
-            hour_avg = temp.groupby("hour_of_day", as_index=False)["pm2_5"].mean()
-            worst = hour_avg.sort_values("pm2_5", ascending=False).iloc[0]
-            kpis["worst_hour_by_avg_pm2_5"] = {"hour": int(worst["hour_of_day"]), "avg_pm2_5": float(worst["pm2_5"])}
+    if {"_hour", "pm2_5"}.issubset(df.columns):
+        hour_avg = df.groupby("_hour", observed=True, sort=False)["pm2_5"].mean().dropna()
+        if not hour_avg.empty:
+            worst = hour_avg.idxmax()
+            kpis["worst_hour_by_avg_pm2_5"] = {"hour": int(worst), "avg_pm2_5": float(hour_avg[worst])}
 
     return kpis
 
@@ -186,17 +252,27 @@ def save_summary_metrics(kpis: dict):
     print(f"✅ Saved summary_metrics.csv to {PROCESSED_DIR}")
 
 
-def save_city_risk_distribution(df: pd.DataFrame):
-    """Save CSV with counts & percentages of risk_flag by city."""
+def _risk_counts_by_city(df: pd.DataFrame) -> pd.Series:
+    """risk_flag counts per city as a (city, risk_flag) Series, in one grouping pass."""
+    return df.groupby("city", observed=True, sort=False)["risk_flag"].value_counts()
+
+
+def save_city_risk_distribution(df: pd.DataFrame) -> pd.DataFrame | None:
+    """Save CSV with counts & percentages of risk_flag by city; return the city x risk_flag count table."""
     if df.empty:
         print("No data for city risk distribution.")
-        return
-    pivot = df.groupby(["city", "risk_flag"]).size().reset_index(name="count")
-    totals = df.groupby("city").size().reset_index(name="total")
-    merged = pivot.merge(totals, on="city", how="left")
-    merged["percent"] = (merged["count"] / merged["total"] * 100).round(2)
-    merged.to_csv(PROCESSED_DIR / "city_risk_distribution.csv", index=False)
+        return None
+    counts_long = _risk_counts_by_city(df)
+    counts = counts_long.unstack(fill_value=0)
+    # totals include hours with a null risk_flag (those get no count row)
+    totals = df.groupby("city", observed=True, sort=False).size()
+
+    out = counts_long[counts_long > 0].rename("count").reset_index()
+    out["total"] = totals.reindex(out["city"]).to_numpy()
+    out["percent"] = (out["count"] / out["total"] * 100).round(2)
+    out.to_csv(PROCESSED_DIR / "city_risk_distribution.csv", index=False)
     print(f"✅ Saved city_risk_distribution.csv to {PROCESSED_DIR}")
+    return counts
 
 
 def save_pollution_trends(df: pd.DataFrame):
@@ -205,95 +281,112 @@ def save_pollution_trends(df: pd.DataFrame):
         print("No data for pollution trends.")
         return
     cols = ["city", "time", "pm2_5", "pm10", "ozone"]
-    trends = df[[c for c in cols if c in df.columns]].copy()
+    trends = df[[c for c in cols if c in df.columns]]
     # keep rows with at least one pollutant value
     trends = trends.dropna(subset=["pm2_5", "pm10", "ozone"], how="all")
     trends.to_csv(PROCESSED_DIR / "pollution_trends.csv", index=False)
     print(f"✅ Saved pollution_trends.csv to {PROCESSED_DIR}")
 
 
-def create_plots(df: pd.DataFrame):
-    """Create and save requested PNG plots."""
+def save_processed_main(limit: int | None = None):
+    """Save the full main table (all columns) as a convenience CSV."""
+    df = _fetch_from_supabase(limit, columns="*")
+    if df.empty:
+        print("No data for processed main table.")
+        return
+    df.to_csv(MAIN_TABLE_CSV, index=False)
+    print(f"✅ Saved {MAIN_TABLE_CSV.name} to {PROCESSED_DIR}")
+
+
+def _save_figure(fig, ax, filename: str, size: tuple, colorbar=None):
+    """Resize, save and clear the shared figure for the next plot."""
+    fig.set_size_inches(size)
+    fig.tight_layout()
+    fig.savefig(PROCESSED_DIR / filename)
+    # colorbar must go before ax.cla() detaches the mappable it is bound to
+    if colorbar is not None:
+        colorbar.remove()
+    ax.cla()
+    print(f"✅ Saved {filename}")
+
+
+def create_plots(df: pd.DataFrame, risk_counts: pd.DataFrame | None = None):
+    """Create and save requested PNG plots (risk_counts: table from save_city_risk_distribution)."""
     if df.empty:
         print("No data to plot.")
         return
 
+    df = _ensure_time_features(df)
+
+    # One figure/axes reused for every plot
+    fig, ax = plt.subplots()
+
     # Histogram of PM2.5
     if "pm2_5" in df.columns:
-        plt.figure(figsize=(8, 4))
-        df["pm2_5"].dropna().plot(kind="hist", bins=30)
-        plt.title("PM2.5 Distribution")
-        plt.xlabel("PM2.5")
-        plt.tight_layout()
-        plt.savefig(PROCESSED_DIR / "pm25_histogram.png")
-        plt.close()
-        print("✅ Saved pm25_histogram.png")
+        df["pm2_5"].dropna().plot(kind="hist", bins=30, ax=ax)
+        ax.set_title("PM2.5 Distribution")
+        ax.set_xlabel("PM2.5")
+        _save_figure(fig, ax, "pm25_histogram.png", (8, 4))
 
     # Bar chart of risk flags per city
     if {"city", "risk_flag"}.issubset(df.columns):
-        agg = df.groupby(["city", "risk_flag"]).size().unstack(fill_value=0)
-        plt.figure(figsize=(10, 6))
-        agg.plot(kind="bar")
-        plt.title("Risk Flags per City")
-        plt.ylabel("Count")
-        plt.tight_layout()
-        plt.savefig(PROCESSED_DIR / "risk_bar_by_city.png")
-        plt.close()
-        print("✅ Saved risk_bar_by_city.png")
+        agg = risk_counts if risk_counts is not None else _risk_counts_by_city(df).unstack(fill_value=0)
+        agg.plot(kind="bar", ax=ax)
+        ax.set_title("Risk Flags per City")
+        ax.set_ylabel("Count")
+        _save_figure(fig, ax, "risk_bar_by_city.png", (10, 6))
 
     # Line chart of hourly PM2.5 trends (per city)
-    if {"time", "pm2_5", "city"}.issubset(df.columns):
-        temp = df.dropna(subset=["time", "pm2_5"]).copy()
-        temp["date_hour"] = temp["time"].dt.floor("h")  # lowercase 'h' to fix deprecation
-        hourly = temp.groupby(["date_hour", "city"], as_index=False)["pm2_5"].mean()
-        pivot = hourly.pivot(index="date_hour", columns="city", values="pm2_5").ffill()  # use df.ffill() instead of fillna(method="ffill")
-        plt.figure(figsize=(12, 6))
-        pivot.plot()
-        plt.title("Hourly Average PM2.5 by City")
-        plt.ylabel("PM2.5")
-        plt.xlabel("Time")
-        plt.tight_layout()
-        plt.savefig(PROCESSED_DIR / "hourly_pm25_trends.png")
-        plt.close()
-        print("✅ Saved hourly_pm25_trends.png")
-
-
-    # Scatter: severity_score vs pm2_5
+    if {"_date_hour", "pm2_5", "city"}.issubset(df.columns):
+        hourly = (df.groupby(["_date_hour", "city"], observed=True, sort=False, as_index=False)["pm2_5"]
+                  .mean().dropna(subset=["pm2_5"]))
+        pivot = hourly.pivot(index="_date_hour", columns="city", values="pm2_5").ffill()  # use df.ffill() instead of fillna(method="ffill")
+        pivot.plot(ax=ax)
+        ax.set_title("Hourly Average PM2.5 by City")
+        ax.set_ylabel("PM2.5")
+        ax.set_xlabel("Time")
+        _save_figure(fig, ax, "hourly_pm25_trends.png", (12, 6))
+
+    # Scatter: severity_score vs pm2_5 (binned density, cost independent of point count)
     if {"severity_score", "pm2_5"}.issubset(df.columns):
         tmp = df.dropna(subset=["severity_score", "pm2_5"])
-        plt.figure(figsize=(8, 6))
-        plt.scatter(tmp["pm2_5"], tmp["severity_score"], alpha=0.6)
-        plt.title("Severity Score vs PM2.5")
-        plt.xlabel("PM2.5")
-        plt.ylabel("Severity Score")
-        plt.tight_layout()
-        plt.savefig(PROCESSED_DIR / "severity_vs_pm25_scatter.png")
-        plt.close()
-        print("✅ Saved severity_vs_pm25_scatter.png")
-
-
-def run_analysis(limit: int | None = None):
-    df = fetch_table(limit=limit)
+        *_, image = ax.hist2d(tmp["pm2_5"], tmp["severity_score"], bins=100, cmin=1)
+        cbar = fig.colorbar(image, ax=ax, label="Hours")
+        ax.set_title("Severity Score vs PM2.5")
+        ax.set_xlabel("PM2.5")
+        ax.set_ylabel("Severity Score")
+        _save_figure(fig, ax, "severity_vs_pm25_scatter.png", (8, 6), colorbar=cbar)
+
+    plt.close(fig)
+
+
+def run_analysis(limit: int | None = None, force_refresh: bool = FORCE_REFRESH):
+    from_cache = not limit and not force_refresh and _cache_is_fresh()
+    df = fetch_table(limit=limit, force_refresh=force_refresh)
     if df.empty:
         print("No data available in Supabase for analysis.")
         return
 
+    # derive time features once, shared by KPIs and plots
+    add_time_features(df)
+
     # compute and save KPIs
     kpis = compute_kpis(df)
     save_summary_metrics(kpis)
 
     # save city risk distribution
-    save_city_risk_distribution(df)
+    risk_counts = save_city_risk_distribution(df)
 
     # save pollution trends
     save_pollution_trends(df)
 
-    # save processed main table (convenience)
-    df.to_csv(PROCESSED_DIR / "air_quality_processed_main.csv", index=False)
-    print(f"✅ Saved air_quality_processed_main.csv to {PROCESSED_DIR}")
+    # save processed main table (convenience) with every column; the analysis fetch
+    # is pruned, so this is its own select("*"), skipped while the cache is in use
+    if not from_cache or not MAIN_TABLE_CSV.exists():
+        save_processed_main(limit)
 
     # create plots
-    create_plots(df)
+    create_plots(df, risk_counts)
 
 
 if __name__ == "__main__":
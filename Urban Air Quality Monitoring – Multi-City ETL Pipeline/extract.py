@@ -1,10 +1,10 @@
 # extract.py
-import json
-import time
+import asyncio
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
-import requests
+from typing import Any, Dict, List, Optional
+import httpx
+import orjson
 import os
 from dotenv import load_dotenv
 
@@ -17,7 +17,7 @@ RAW_DIR.mkdir(parents=True, exist_ok=True)
 API_BASE = os.getenv("OPENAQ_API_BASE", "https://air-quality-api.open-meteo.com/v1/air-quality")
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
 TIMEOUT_SECONDS = int(os.getenv("TIMEOUT_SECONDS", 10))
-SLEEP_BETWEEN_CALLS = float(os.getenv("SLEEP_BETWEEN_CALLS", 0.5))
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", 8))
 
 # Cities with coordinates
 CITIES_COORDS = {
@@ -42,8 +42,8 @@ def _save_raw(payload: object, city: str) -> str:
     filename = f"{city.replace(' ', '_').lower()}_raw_{ts}.json"
     path = RAW_DIR / filename
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2, default=str)
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2, default=str))
     except Exception:
         # fallback to plain text
         path = RAW_DIR / f"{city.replace(' ', '_').lower()}_raw_{ts}.txt"
@@ -52,8 +52,10 @@ def _save_raw(payload: object, city: str) -> str:
     return str(path.resolve())
 
 
-def _fetch_city(city: str, lat: float, lon: float) -> Dict[str, Optional[str]]:
-    """Fetch Open-Meteo AQI data for one city with retries."""
+async def _fetch_city_async(
+    client: httpx.AsyncClient, city: str, lat: float, lon: float
+) -> Dict[str, Any]:
+    """Fetch Open-Meteo AQI data for one city with retries; the parsed payload is returned too."""
     attempt = 0
     last_error: Optional[str] = None
 
@@ -65,13 +67,13 @@ def _fetch_city(city: str, lat: float, lon: float) -> Dict[str, Optional[str]]:
                 "longitude": lon,
                 "hourly": HOURLY_PARAMS
             }
-            resp = requests.get(API_BASE, params=params, timeout=TIMEOUT_SECONDS)
+            resp = await client.get(API_BASE, params=params)
             resp.raise_for_status()
-            payload = resp.json()
+            payload = orjson.loads(resp.content)
             saved_path = _save_raw(payload, city)
             print(f"✅ [{city}] fetched and saved to: {saved_path}")
-            return {"city": city, "success": "true", "raw_path": saved_path}
-        except requests.RequestException as e:
+            return {"city": city, "success": "true", "raw_path": saved_path, "payload": payload}
+        except httpx.HTTPError as e:
             last_error = str(e)
             print(f"⚠️ [{city}] attempt {attempt}/{MAX_RETRIES} failed: {e}")
         except Exception as e:
@@ -80,19 +82,25 @@ def _fetch_city(city: str, lat: float, lon: float) -> Dict[str, Optional[str]]:
 
         backoff = 2 ** (attempt - 1)
         print(f"⏳ [{city}] retrying in {backoff}s ...")
-        time.sleep(backoff)
+        await asyncio.sleep(backoff)
 
     print(f"❌ [{city}] failed after {MAX_RETRIES} attempts. Last error: {last_error}")
     return {"city": city, "success": "false", "error": last_error}
 
 
-def fetch_all_cities() -> List[Dict[str, Optional[str]]]:
-    results = []
-    for city, (lat, lon) in CITIES_COORDS.items():
-        res = _fetch_city(city, lat, lon)
-        results.append(res)
-        time.sleep(SLEEP_BETWEEN_CALLS)
-    return results
+async def fetch_all_cities_async() -> List[Dict[str, Any]]:
+    """Fetch all cities concurrently over one HTTP/2 client; results keep CITIES_COORDS order."""
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS)
+    async with httpx.AsyncClient(http2=True, timeout=TIMEOUT_SECONDS, limits=limits) as client:
+        return await asyncio.gather(*[
+            _fetch_city_async(client, city, lat, lon)
+            for city, (lat, lon) in CITIES_COORDS.items()
+        ])
+
+
+def fetch_all_cities() -> List[Dict[str, Any]]:
+    """Synchronous entry point for the pipeline runner."""
+    return asyncio.run(fetch_all_cities_async())
 
 
 if __name__ == "__main__":
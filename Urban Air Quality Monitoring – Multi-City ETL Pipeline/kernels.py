@@ -0,0 +1,77 @@
+# kernels.py
+"""
+Numba kernels for the transform step.
+
+Kernels are compiled eagerly from explicit signatures and cached to
+__pycache__ (cache=True), so only the first run on a machine pays the
+LLVM compile. `python -c "import kernels"` warms the cache.
+"""
+import numpy as np
+from numba import njit, prange
+
+# Labels indexed by the int8 codes classify_hours emits
+AQI_LABELS = np.array(["Good", "Moderate", "Unhealthy", "Very Unhealthy", "Hazardous", "Unknown"])
+RISK_LABELS = np.array(["Low Risk", "Moderate Risk", "High Risk"])
+
+
+@njit("f8(f8)", inline="always", cache=True)
+def _nan_to_zero(x):
+    return 0.0 if np.isnan(x) else x
+
+
+# Severity score, AQI category and risk classification in one pass
+@njit("void(f8[:], f8[:], f8[:], f8[:], f8[:], f8[:], f8[:], i1[:], i1[:])",
+      parallel=True, cache=True)
+def _classify_hours_kernel(pm2_5, pm10, no2, so2, co, o3, severity, aqi, risk):
+    for i in prange(pm2_5.shape[0]):
+        # Missing readings count as 0
+        s = (
+            _nan_to_zero(pm2_5[i]) * 5 +
+            _nan_to_zero(pm10[i]) * 3 +
+            _nan_to_zero(no2[i]) * 4 +
+            _nan_to_zero(so2[i]) * 4 +
+            _nan_to_zero(co[i]) * 2 +
+            _nan_to_zero(o3[i]) * 3
+        )
+        severity[i] = s
+
+        # AQI categories based on PM2.5 (upper bounds are inclusive)
+        p = pm2_5[i]
+        if np.isnan(p):
+            aqi[i] = 5
+        elif p <= 50:
+            aqi[i] = 0
+        elif p <= 100:
+            aqi[i] = 1
+        elif p <= 200:
+            aqi[i] = 2
+        elif p <= 300:
+            aqi[i] = 3
+        else:
+            aqi[i] = 4
+
+        # Risk classification
+        if s > 400:
+            risk[i] = 2
+        elif s > 200:
+            risk[i] = 1
+        else:
+            risk[i] = 0
+
+
+def classify_hours(pm2_5, pm10, no2, so2, co, o3):
+    """Return (severity float64, AQI int8 codes, risk int8 codes) for 1-D pollutant arrays."""
+    # The eager signature takes writable contiguous float64 only; copy read-only
+    # (pandas Copy-on-Write) or non-float64 inputs, pass the rest through as-is
+    pm2_5, pm10, no2, so2, co, o3 = (
+        np.require(x, np.float64, ["C", "W"]) for x in (pm2_5, pm10, no2, so2, co, o3)
+    )
+    # the prange kernel does no bounds checking, so every input must match pm2_5
+    if any(x.shape != pm2_5.shape for x in (pm10, no2, so2, co, o3)):
+        raise ValueError("classify_hours: all pollutant arrays must have the same length")
+    n = pm2_5.shape[0]
+    severity = np.empty(n, dtype=np.float64)
+    aqi = np.empty(n, dtype=np.int8)
+    risk = np.empty(n, dtype=np.int8)
+    _classify_hours_kernel(pm2_5, pm10, no2, so2, co, o3, severity, aqi, risk)
+    return severity, aqi, risk
@@ -1,9 +1,10 @@
+import numpy as np
 import pandas as pd
 from supabase import create_client, Client
 from pathlib import Path
 from dotenv import load_dotenv
 import os
-import math
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
@@ -13,42 +14,55 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 TABLE_NAME = "air_quality_data"
+BATCH_SIZE = int(os.getenv("LOAD_BATCH_SIZE", 2000))
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", 4))
 
 
 # -------------------------------------------------------
-# 🔹 Clean values so Supabase JSON can accept them
+# 🔹 Insert one batch (runs on a worker thread)
 # -------------------------------------------------------
-def clean_value(v):
-    if v is None:
-        return None
-    if isinstance(v, float):
-        if math.isnan(v) or math.isinf(v):
-            return None
-    return v
+def insert_batch(start, batch):
+    try:
+        supabase.table(TABLE_NAME).insert(batch).execute()
+        print(f"   ✅ Inserted rows {start} → {start + len(batch)}")
+        return len(batch)
+
+    except Exception as e:
+        print("❌ Insert Error:", e)
+        print("   🔎 Example cleaned row:", batch[0])
+        return 0
 
 
 # -------------------------------------------------------
-# 🔹 Load CSV into Supabase
+# 🔹 Load staged Parquet (or legacy CSV) into Supabase
 # -------------------------------------------------------
 def load_csv_to_supabase(csv_path):
-    print(f"📥 Loading CSV: {csv_path}")
+    print(f"📥 Loading staged file: {csv_path}")
+
+    if Path(csv_path).suffix == ".parquet":
+        df = pd.read_parquet(csv_path)
+    else:
+        # Arrow's multi-threaded parser; "nan"/"NaN"/"None"/"" parse as nulls
+        df = pd.read_csv(csv_path, engine="pyarrow")
 
-    df = pd.read_csv(csv_path)
+    load_df_to_supabase(df)
 
-    # STEP 1 — Replace string NaN
-    df = df.replace(["nan", "NaN", "None", ""], pd.NA)
 
-    # STEP 2 — Fix column names
-    df.rename(columns={
+# -------------------------------------------------------
+# 🔹 Clean a staged DataFrame and load it into Supabase
+# -------------------------------------------------------
+def load_df_to_supabase(df):
+    # STEP 1 — Fix column names (copy; the caller's frame is left untouched)
+    df = df.rename(columns={
         "AQI_category": "aqi_category",
         "risk": "risk_flag"
-    }, inplace=True)
+    })
 
-    # STEP 3 — Convert datetime → ISO string
+    # STEP 2 — Convert datetime → ISO string
     df["time"] = pd.to_datetime(df["time"], errors="coerce")
     df["time"] = df["time"].dt.strftime("%Y-%m-%d %H:%M:%S")
 
-    # STEP 4 — Normalize float columns
+    # STEP 3 — Normalize float columns
     float_cols = [
         "pm10", "pm2_5", "carbon_monoxide", "nitrogen_dioxide",
         "sulphur_dioxide", "ozone", "uv_index", "severity_score"
@@ -58,49 +72,36 @@ def load_csv_to_supabase(csv_path):
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors="coerce")
 
-    # STEP 5 — Replace NaN/inf with None
-    df = df.astype(object)
-    for col in df.columns:
-        df[col] = df[col].apply(clean_value)
+    # STEP 4 — Replace NaN/inf with None so Supabase JSON can accept them
+    present = [col for col in float_cols if col in df.columns]
+    df[present] = df[present].replace([np.inf, -np.inf], np.nan)
+    df = df.astype(object).where(df.notna(), None)
 
     print(f"📦 Total records: {len(df)}")
 
-    # STEP 6 — Convert to Python dict list
+    # STEP 5 — Convert to Python dict list
     records = df.to_dict(orient="records")
 
-    BATCH_SIZE = 200
-
-    # STEP 7 — Batch insert
-    for i in range(0, len(records), BATCH_SIZE):
-        batch = records[i:i + BATCH_SIZE]
-
-        # Clean each row again before send
-        cleaned_batch = [
-            {k: clean_value(v) for k, v in row.items()}
-            for row in batch
-        ]
-
-        try:
-            supabase.table(TABLE_NAME).insert(cleaned_batch).execute()
-            print(f"   ✅ Inserted rows {i} → {i + len(batch)}")
+    # STEP 6 — Batch insert (batches are posted in parallel)
+    starts = range(0, len(records), BATCH_SIZE)
+    batches = [records[i:i + BATCH_SIZE] for i in starts]
 
-        except Exception as e:
-            print("❌ Insert Error:", e)
-            print("   🔎 Example cleaned row:", cleaned_batch[0])
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as ex:
+        inserted = sum(ex.map(insert_batch, starts, batches))
 
-    print("🎉 Data successfully loaded into Supabase!")
+    print(f"🎉 Loaded {inserted}/{len(records)} rows into Supabase!")
 
 
 # -------------------------------------------------------
-# 🔹 Main — Pick the latest staged CSV
+# 🔹 Main — Pick the latest staged Parquet
 # -------------------------------------------------------
 if __name__ == "__main__":
     staged_dir = Path("data/staged")
-    csv_files = sorted(staged_dir.glob("air_quality_transformed_*.csv"))
+    # names end in a sortable timestamp, so the max name is the newest file
+    latest = max(staged_dir.glob("air_quality_transformed_*.parquet"), default=None)
 
-    if not csv_files:
-        print("❌ No CSV found in data/staged/")
+    if latest is None:
+        print("❌ No Parquet found in data/staged/")
         exit()
 
-    latest = csv_files[-1]
     load_csv_to_supabase(latest)
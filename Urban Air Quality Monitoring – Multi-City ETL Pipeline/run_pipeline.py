@@ -3,8 +3,8 @@ import sys
 import os
 import locale
 from extract import fetch_all_cities
-from transform import transform_all
-from load import load_csv_to_supabase
+from transform import transform_all_from_payloads
+from load import load_df_to_supabase
 from etl_analysis import run_analysis  # KPI & visualization functions
 
 # Fix Unicode issue for Windows consoles
@@ -28,12 +28,12 @@ def run_pipeline():
     # 2️⃣ Transform
     print("2️⃣ Transforming data ...")
     try:
-        # Pass only successful raw file paths
-        raw_files = [f["raw_path"] for f in extracted_files if f.get("success") == "true"]
-        if not raw_files:
+        # Pass only successful payloads (already parsed in memory)
+        extracted = [f for f in extracted_files if f.get("success") == "true"]
+        if not extracted:
             raise ValueError("No successful extracted files to transform.")
-        staged_csv = transform_all(raw_files)
-        print(f"✅ Transformation complete. Staged CSV: {staged_csv}\n")
+        staged_df, staged_path = transform_all_from_payloads(extracted)
+        print(f"✅ Transformation complete. Staged Parquet: {staged_path}\n")
     except Exception as e:
         print(f"❌ Transformation failed: {e}")
         sys.exit(1)
@@ -41,7 +41,8 @@ def run_pipeline():
     # 3️⃣ Load
     print("3️⃣ Loading data into Supabase ...")
     try:
-        load_csv_to_supabase(staged_csv)
+        # Hand the staged frame over in memory; the Parquet file is kept for audit only
+        load_df_to_supabase(staged_df)
         print("✅ Loading complete.\n")
     except Exception as e:
         print(f"❌ Loading failed: {e}")
@@ -50,7 +51,8 @@ def run_pipeline():
     # 4️⃣ Analysis
     print("4️⃣ Running ETL Analysis ...")
     try:
-        run_analysis()
+        # Rows were just loaded, so bypass the cached snapshot
+        run_analysis(force_refresh=True)
         print("✅ Analysis complete.\n")
     except Exception as e:
         print(f"❌ Analysis failed: {e}")
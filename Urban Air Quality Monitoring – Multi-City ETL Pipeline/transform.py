@@ -1,9 +1,11 @@
 # transform.py
-import json
 from pathlib import Path
 from datetime import datetime
-from typing import List
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import orjson
 import pandas as pd
+from kernels import AQI_LABELS, RISK_LABELS, classify_hours
 import os
 
 BASE_DIR = Path(__file__).resolve().parents[0]
@@ -11,53 +13,31 @@ RAW_DIR = BASE_DIR / "data" / "raw"
 STAGED_DIR = BASE_DIR / "data" / "staged"
 STAGED_DIR.mkdir(parents=True, exist_ok=True)
 
-# AQI categories based on PM2.5
-def classify_aqi(pm2_5: float) -> str:
-    if pm2_5 <= 50:
-        return "Good"
-    elif pm2_5 <= 100:
-        return "Moderate"
-    elif pm2_5 <= 200:
-        return "Unhealthy"
-    elif pm2_5 <= 300:
-        return "Very Unhealthy"
-    else:
-        return "Hazardous"
-
-# Severity score calculation
-def compute_severity(row: pd.Series) -> float:
-    return (
-        row.get("pm2_5", 0) * 5 +
-        row.get("pm10", 0) * 3 +
-        row.get("nitrogen_dioxide", 0) * 4 +
-        row.get("sulphur_dioxide", 0) * 4 +
-        row.get("carbon_monoxide", 0) * 2 +
-        row.get("ozone", 0) * 3
-    )
-
-# Risk classification
-def risk_classification(severity: float) -> str:
-    if severity > 400:
-        return "High Risk"
-    elif severity > 200:
-        return "Moderate Risk"
-    else:
-        return "Low Risk"
+# Pollutants in the argument order of classify_hours
+SEVERITY_COLUMNS = ["pm2_5", "pm10", "nitrogen_dioxide",
+                    "sulphur_dioxide", "carbon_monoxide", "ozone"]
+
+
 def flatten_city_json(json_path: str) -> pd.DataFrame:
-    """Flatten Open-Meteo city JSON into DataFrame with one row per hour"""
-    with open(json_path, "r") as f:
-        payload = json.load(f)
+    """Read a raw city JSON file and flatten it (city name taken from the filename)"""
+    with open(json_path, "rb") as f:
+        payload = orjson.loads(f.read())
 
+    return flatten_city_payload(payload, Path(json_path).stem.split("_")[0].capitalize())
+
+
+def flatten_city_payload(payload: Any, city_name: str) -> pd.DataFrame:
+    """Flatten Open-Meteo city payload into DataFrame with one row per hour"""
     # If payload is a list, take the first element
     if isinstance(payload, list) and payload:
         payload = payload[0]
     elif isinstance(payload, list) and not payload:
         # empty list
-        print(f"⚠️ {json_path} is empty list, skipping.")
+        print(f"⚠️ {city_name} payload is empty list, skipping.")
         return pd.DataFrame()  # return empty DF
 
-    # Determine city name from payload or filename
-    city_name = payload.get("city") or Path(json_path).stem.split("_")[0].capitalize()
+    # Prefer city name embedded in the payload
+    city_name = payload.get("city") or city_name
 
     hourly = payload.get("hourly", {})
     if not hourly:
@@ -71,50 +51,71 @@ def flatten_city_json(json_path: str) -> pd.DataFrame:
     # Determine max length
     max_len = max(len(hourly.get(c, [])) for c in cols + ["time"])
 
-    # Pad shorter arrays
-    data = {}
-    for c in ["time"] + cols:
+    # Build typed columns directly, padding shorter arrays (None -> NaN/NaT)
+    times = hourly.get("time", [])
+    data = {
+        "time": pd.to_datetime(times + [None] * (max_len - len(times)),
+                               format="%Y-%m-%dT%H:%M", errors="coerce", cache=True)
+    }
+    for c in cols:
         arr = hourly.get(c, [])
-        if len(arr) < max_len:
-            arr.extend([None] * (max_len - len(arr)))
-        data[c] = arr
+        data[c] = np.asarray(arr + [None] * (max_len - len(arr)), dtype=np.float64)
 
     # Convert to DataFrame
     df = pd.DataFrame(data)
-    df["time"] = pd.to_datetime(df["time"], errors="coerce")
-    for c in cols:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
 
-    df["city"] = city_name
-    df["hour"] = df["time"].dt.hour
+    # Compact dtypes: single-category city, nullable int8 hour
+    df["city"] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), categories=[city_name])
+    df["hour"] = df["time"].dt.hour.astype("Int8")
 
-    # --- Feature engineering ---
-    df["AQI_category"] = df["pm2_5"].apply(classify_aqi)
-    df["severity_score"] = df.apply(compute_severity, axis=1)
-    df["risk"] = df["severity_score"].apply(risk_classification)
+    # --- Feature engineering (single fused pass) ---
+    severity, aqi_codes, risk_codes = classify_hours(*(data[c] for c in SEVERITY_COLUMNS))
+    df["AQI_category"] = pd.Categorical.from_codes(aqi_codes, categories=AQI_LABELS)
+    df["severity_score"] = severity
+    df["risk"] = pd.Categorical.from_codes(risk_codes, categories=RISK_LABELS)
 
     # Drop rows where all pollutants are missing
     df = df.dropna(subset=cols, how="all")
 
     return df
 
-def transform_all(raw_json_paths: List[str]) -> str:
-    """Transform all raw JSON files into a single staged CSV"""
+def transform_all(raw_json_paths: List[str]) -> Tuple[pd.DataFrame, str]:
+    """Transform all raw JSON files into a single staged Parquet file"""
     dfs = []
     for path in raw_json_paths:
         print(f"🔁 Transforming {path} ...")
         df = flatten_city_json(path)
-        dfs.append(df)
+        if not df.empty:
+            dfs.append(df)
+
+    return _stage(dfs)
+
+
+def transform_all_from_payloads(extracted: List[Dict[str, Any]]) -> Tuple[pd.DataFrame, str]:
+    """Transform in-memory extract results into a single staged Parquet file"""
+    dfs = []
+    for res in extracted:
+        print(f"🔁 Transforming {res['city']} ...")
+        df = flatten_city_payload(res["payload"], res["city"])
+        if not df.empty:
+            dfs.append(df)
+
+    return _stage(dfs)
+
 
+def _stage(dfs: List[pd.DataFrame]) -> Tuple[pd.DataFrame, str]:
+    """Concatenate per-city frames, write the staged Parquet file (for audit) and return both"""
     if not dfs:
-        raise ValueError("No raw JSON files found for transformation")
+        raise ValueError("No usable raw JSON files found for transformation")
 
     final_df = pd.concat(dfs, ignore_index=True)
+    # Per-city categories differ, so concat falls back to object; re-pack once
+    final_df["city"] = final_df["city"].astype("category")
 
-    staged_path = STAGED_DIR / f"air_quality_transformed_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    final_df.to_csv(staged_path, index=False)
+    staged_path = STAGED_DIR / f"air_quality_transformed_{datetime.now().strftime('%Y%m%d_%H%M%S')}.parquet"
+    final_df.to_parquet(staged_path, compression="zstd", index=False)
     print(f"✅ Transformed AQI data saved to: {staged_path}")
-    return str(staged_path)
+    return final_df, str(staged_path)
 
 if __name__ == "__main__":
     raw_files = sorted([str(p) for p in RAW_DIR.glob("*_raw_*.json")])